@@ -1,37 +1,220 @@
+import heapq
+import json
 import os
-import pickle
 import time
-from datetime import datetime
-from threading import Lock, Thread
-from typing import Dict, List, Optional, Tuple
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import asdict
+from threading import Condition, Event, Lock, Thread
+from typing import Dict, Iterator, List, Optional, Tuple
 
 from parse_data import DNSResourceRecord, DNSRecordType
 
 
+class RWLock:
+    """Блокировка чтения-записи: читатели не блокируют друг друга"""
+
+    def __init__(self):
+        self._cond = Condition(Lock())
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+
+    @contextmanager
+    def read_lock(self) -> Iterator[None]:
+        """Захват на чтение (ждущий писатель имеет приоритет)"""
+        with self._cond:
+            while self._writer or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write_lock(self) -> Iterator[None]:
+        """Эксклюзивный захват на запись"""
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+
+
+# Заголовок файла кэша: сигнатура и версия формата
+CACHE_FILE_MAGIC = b"DNSCACHE"
+CACHE_FILE_VERSION = 1
+
+# Журнал добавленных записей: размер буфера, период сброса на диск (секунды)
+# и минимальный размер, начиная с которого журнал сворачивается в снимок
+LOG_BUFFER_SIZE = 64 * 1024
+LOG_FLUSH_INTERVAL = 1
+LOG_MIN_COMPACT_SIZE = 64 * 1024
+
+# Число доменов, кодируемых в снимок за один вызов json.dumps
+SNAPSHOT_CHUNK_SIZE = 1000
+
+# Предел числа доменов в кэше, если он не задан в настройках
+DEFAULT_MAX_ENTRIES = 100_000
+
+# Число сегментов кэша (степень двойки - сегмент выбирается маской хэша)
+CACHE_SHARDS = 16
+
+# Сегмент хранит домены в порядке последнего использования (LRU)
+CacheShard = OrderedDict[str, Dict[DNSRecordType, Tuple[float, List[DNSResourceRecord]]]]
+
+# Заглушка для отсутствующего домена (только для чтения)
+_NO_ENTRIES: Dict[DNSRecordType, Tuple[float, List[DNSResourceRecord]]] = {}
+
+
 class DNSCache:
     """Кэш DNS-записей с периодической очисткой и сохранением на диск"""
 
-    def __init__(self, cache_file_path: str, cleanup_interval: int):
+    def __init__(self, cache_file_path: str, cleanup_interval: int, max_entries: int = DEFAULT_MAX_ENTRIES):
         self.cache_file = cache_file_path
-        self.cache_data: Dict[str, Dict[DNSRecordType, Tuple[datetime, List[DNSResourceRecord]]]]= {}
+        # Предел числа доменов в кэше; делится между сегментами так, чтобы сумма
+        # емкостей была ровно max_entries (при max_entries < CACHE_SHARDS часть
+        # сегментов ничего не хранит)
+        self.max_entries = max_entries
+        self._shard_capacities: List[int] = [
+            max_entries // CACHE_SHARDS + (1 if index < max_entries % CACHE_SHARDS else 0)
+            for index in range(CACHE_SHARDS)
+        ]
+        self.log_file = f"{cache_file_path}.log"
+        # Журнал, отложенный на время сворачивания в снимок
+        self.rotated_log_file = f"{self.log_file}.old"
+        self._log = None
+        self._log_lock = Lock()
+        # Кэш разбит на сегменты по хэшу домена, у каждого своя блокировка
+        self._shards: List[CacheShard] = [OrderedDict() for _ in range(CACHE_SHARDS)]
+        self._locks: List[RWLock] = [RWLock() for _ in range(CACHE_SHARDS)]
+        # Порядок LRU меняют и читатели, поэтому перестановка и обход сегмента
+        # под блокировкой чтения дополнительно защищены мьютексом сегмента
+        self._lru_locks: List[Lock] = [Lock() for _ in range(CACHE_SHARDS)]
+        # Очередь сроков истечения: (expiry, domain, query_type), ближайший - в голове
+        self._expiry_heap: List[Tuple[float, str, DNSRecordType]] = []
+        self._expiry_heap_limit = 2 * max_entries
+        self._expiry_cond = Condition()
+        # Сигнал остановки фоновых процессов
+        self._stop = Event()
         self.cleanup_thread = Thread(target=self._run_cache_cleanup,
                                      args=(cleanup_interval,),
                                      daemon=True)
-        self.lock = Lock()
+        self.log_thread = Thread(target=self._run_log_maintenance, daemon=True)
+
+    @staticmethod
+    def _shard(domain: str) -> int:
+        """Номер сегмента, в котором хранится домен"""
+        return hash(domain) & (CACHE_SHARDS - 1)
 
     def initialize_cache(self) -> None:
-        """Загружает кэш из файла при инициализации"""
+        """Загружает кэш из снимка и журнала при инициализации"""
         try:
             if os.path.getsize(self.cache_file) > 0:
                 with open(self.cache_file, "rb") as file:
-                    self.cache_data = pickle.load(file)
+                    self._load_snapshot(file.read())
         except FileNotFoundError:
             open(self.cache_file, "a").close()
             print(f"Created new cache file: {self.cache_file}")
 
+        # Отложенный журнал остается, если процесс упал во время сворачивания
+        rotated = os.path.exists(self.rotated_log_file)
+        intact = self._replay_log(self.rotated_log_file)
+        intact = self._replay_log(self.log_file) and intact
+        if rotated or not intact:
+            # Все прочитанное уже в снимке, журнал начинаем заново: иначе новые
+            # строки дописывались бы к оборванной и терялись при следующем чтении
+            self.save_cache()
+            open(self.log_file, "wb").close()
+            if rotated:
+                os.remove(self.rotated_log_file)
+        self._log = open(self.log_file, "ab", buffering=LOG_BUFFER_SIZE)
+
+        with self._expiry_cond:
+            self._expiry_heap = [
+                (expiry, domain, q_type)
+                for shard in self._shards
+                for domain, entries in shard.items()
+                for q_type, (expiry, _) in entries.items()
+            ]
+            heapq.heapify(self._expiry_heap)
+
+    def _load_snapshot(self, raw: bytes) -> None:
+        """Восстанавливает записи из снимка, пропуская уже устаревшие"""
+        header = CACHE_FILE_MAGIC + bytes([CACHE_FILE_VERSION])
+        if not raw.startswith(header):
+            print(f"Unknown cache file format, ignoring: {self.cache_file}")
+            return
+
+        try:
+            snapshot = json.loads(raw[len(header):])
+        except ValueError:
+            print(f"Corrupt cache file, ignoring: {self.cache_file}")
+            return
+
+        # Одна испорченная запись не должна мешать запуску сервера
+        for domain, entries in snapshot.items():
+            for q_type, entry in entries.items():
+                try:
+                    expires_at, records = entry
+                    self._restore_entry(domain, q_type, expires_at, records)
+                except (TypeError, ValueError) as e:
+                    print(f"Skipping corrupt cache entry {domain!r}: {e}")
+
+    def _replay_log(self, path: str) -> bool:
+        """Применяет к кэшу записи, добавленные после последнего снимка.
+
+        Возвращает False, если в журнале встретились недописанные или испорченные строки
+        """
+        intact = True
+        try:
+            with open(path, "rb") as file:
+                for line in file:
+                    try:
+                        domain, q_type, expires_at, records = json.loads(line)
+                    except (TypeError, ValueError):
+                        # Недописанная строка после аварийного завершения
+                        intact = False
+                        continue
+                    try:
+                        self._restore_entry(domain, q_type, expires_at, records)
+                    except (TypeError, ValueError) as e:
+                        print(f"Skipping corrupt cache entry {domain!r}: {e}")
+                        intact = False
+        except FileNotFoundError:
+            pass
+        return intact
+
+    def _restore_entry(self, domain: str, q_type, expires_at: float, records: List[dict]) -> None:
+        """Кладет сохраненную запись в кэш, если она еще не устарела"""
+        # На диске хранится время по часам системы, в памяти - по монотонным часам
+        expiry = expires_at - time.time() + time.monotonic()
+        if expiry <= time.monotonic():
+            return
+        restored = [DNSResourceRecord(**record) for record in records]
+        index = self._shard(domain)
+        shard = self._shards[index]
+        # Тип вопроса в живом кэше - обычное число, в том числе вне DNSRecordType
+        # (например, ANY), поэтому и восстанавливаем его числом
+        shard.setdefault(domain, {})[int(q_type)] = (expiry, restored)
+        shard.move_to_end(domain)
+        self._evict_overflow(index)
+
     def start_cleanup_process(self) -> None:
-        """Запускает фоновый процесс очистки кэша"""
+        """Запускает фоновые процессы очистки кэша и обслуживания журнала"""
         self.cleanup_thread.start()
+        self.log_thread.start()
 
     def add_records(
             self,
@@ -40,12 +223,44 @@ class DNSCache:
             records: List[DNSResourceRecord],
     ) -> None:
         """Добавляет записи в кэш"""
-        with self.lock:
-            if domain_name not in self.cache_data:
-                self.cache_data[domain_name] = {}
+        index = self._shard(domain_name)
+        shard = self._shards[index]
+        with self._locks[index].write_lock():
+            if domain_name not in shard:
+                shard[domain_name] = {}
+
+            if query_type in shard[domain_name]:
+                return
+            # Записи устаревают вместе с самой короткоживущей из них
+            expiry = time.monotonic() + min((record.ttl for record in records), default=0)
+            shard[domain_name][query_type] = (expiry, records)
+            shard.move_to_end(domain_name)
+            self._evict_overflow(index)
+            if domain_name not in shard:
+                # Сегмент нулевой емкости - запись сразу вытеснена
+                return
+            self._schedule_expiry(expiry, domain_name, query_type)
 
-            if query_type not in self.cache_data[domain_name]:
-                self.cache_data[domain_name][query_type] = (datetime.now(), records)
+        # Запись попадает в журнал только после вставки в сегмент: снимок, снятый
+        # после смены журнала, уже содержит все записи из отложенного журнала
+        self._append_to_log(domain_name, query_type, expiry, records)
+
+    def _append_to_log(
+            self,
+            domain: str,
+            query_type: DNSRecordType,
+            expiry: float,
+            records: List[DNSResourceRecord],
+    ) -> None:
+        """Дописывает добавленные записи в журнал"""
+        expires_at = expiry - time.monotonic() + time.time()
+        line = json.dumps(
+            [domain, int(query_type), expires_at, [asdict(record) for record in records]],
+            separators=(",", ":"),
+        )
+        with self._log_lock:
+            if self._log is not None:
+                self._log.write(line.encode() + b"\n")
 
     def get_records(
             self,
@@ -53,42 +268,164 @@ class DNSCache:
             query_type: DNSRecordType
     ) -> Optional[List[DNSResourceRecord]]:
         """Получает записи из кэша, если они еще актуальны"""
-        if domain_name in self.cache_data and query_type in self.cache_data[domain_name]:
-            if self._records_expired(domain_name, query_type):
-                self._remove_expired_records(domain_name, query_type)
-                return None
-            return self.cache_data[domain_name][query_type][1]
+        index = self._shard(domain_name)
+        shard = self._shards[index]
+        with self._locks[index].read_lock():
+            entry = shard.get(domain_name, _NO_ENTRIES).get(query_type)
+            if entry is not None:
+                with self._lru_locks[index]:
+                    shard.move_to_end(domain_name)
+        if entry is None:
+            return None
+
+        expiry, records = entry
+        if time.monotonic() < expiry:
+            return records
+
+        self._remove_expired_records(domain_name, query_type)
         return None
 
+    def _evict_overflow(self, index: int) -> None:
+        """Вытесняет давно не использованные домены сверх емкости сегмента"""
+        shard = self._shards[index]
+        while len(shard) > self._shard_capacities[index]:
+            shard.popitem(last=False)
+
+    def _schedule_expiry(self, expiry: float, domain: str, query_type: DNSRecordType) -> None:
+        """Ставит запись в очередь на удаление и будит поток очистки, если она ближайшая"""
+        with self._expiry_cond:
+            heapq.heappush(self._expiry_heap, (expiry, domain, query_type))
+            if len(self._expiry_heap) > self._expiry_heap_limit:
+                self._compact_expiry_heap()
+            if self._expiry_heap[0][0] == expiry:
+                self._expiry_cond.notify()
+
+    def _compact_expiry_heap(self) -> None:
+        """Убирает из очереди элементы вытесненных и замененных записей"""
+        # Вызывается под self._expiry_cond, поэтому сегменты читаются без их блокировок
+        # (иначе порядок захвата был бы обратным). Запись попадает в сегмент раньше,
+        # чем в очередь, так что живые элементы не теряются
+        self._expiry_heap = [
+            (expiry, domain, q_type)
+            for expiry, domain, q_type in self._expiry_heap
+            if self._is_scheduled(expiry, domain, q_type)
+        ]
+        heapq.heapify(self._expiry_heap)
+        self._expiry_heap_limit = max(2 * self.max_entries, 2 * len(self._expiry_heap))
+
+    def _is_scheduled(self, expiry: float, domain: str, query_type: DNSRecordType) -> bool:
+        """Проверяет, что элемент очереди относится к записи, которая еще в кэше"""
+        entry = self._shards[self._shard(domain)].get(domain, _NO_ENTRIES).get(query_type)
+        return entry is not None and entry[0] == expiry
+
     def _run_cache_cleanup(self, interval: int) -> None:
-        """Фоновый процесс очистки устаревших записей"""
-        while True:
-            for domain in list(self.cache_data.keys()):
-                for q_type in list(self.cache_data[domain].keys()):
-                    if self._records_expired(domain, q_type):
-                        self._remove_expired_records(domain, q_type)
-            time.sleep(interval)
+        """Фоновый процесс очистки: спит до ближайшего истечения срока записи"""
+        while not self._stop.is_set():
+            with self._expiry_cond:
+                now = time.monotonic()
+                expired = []
+                while self._expiry_heap and self._expiry_heap[0][0] <= now:
+                    expired.append(heapq.heappop(self._expiry_heap))
+                if not expired:
+                    if self._stop.is_set():
+                        return
+                    timeout = interval
+                    if self._expiry_heap:
+                        timeout = min(timeout, self._expiry_heap[0][0] - now)
+                    self._expiry_cond.wait(timeout)
+                    continue
+            # Устаревшие элементы очереди (запись уже заменена или удалена)
+            # отбрасываются проверкой внутри _remove_expired_records
+            for _, domain, q_type in expired:
+                self._remove_expired_records(domain, q_type)
 
     def _remove_expired_records(self, domain: str, query_type: DNSRecordType) -> None:
         """Удаляет устаревшие записи из кэша"""
-        with self.lock:
-            self.cache_data[domain].pop(query_type)
-            if not self.cache_data[domain]:
-                self.cache_data.pop(domain)
+        index = self._shard(domain)
+        shard = self._shards[index]
+        with self._locks[index].write_lock():
+            # Записи могли обновиться или удалиться, пока блокировка была отпущена
+            entries = shard.get(domain, _NO_ENTRIES)
+            entry = entries.get(query_type)
+            if entry is None or time.monotonic() < entry[0]:
+                return
+            del entries[query_type]
+            if not entries:
+                del shard[domain]
 
-    def _records_expired(self, domain: str, query_type: DNSRecordType) -> bool:
-        """Проверяет, устарели ли записи"""
-        cached_time, records = self.cache_data[domain][query_type]
-        time_elapsed = (datetime.now() - cached_time).seconds
+    def _run_log_maintenance(self) -> None:
+        """Фоновый процесс: сбрасывает журнал на диск и сворачивает его в снимок"""
+        while not self._stop.wait(LOG_FLUSH_INTERVAL):
+            try:
+                with self._log_lock:
+                    if self._log is None:
+                        continue
+                    self._log.flush()
+                    log_size = self._log.tell()
+                if log_size > 2 * max(os.path.getsize(self.cache_file), LOG_MIN_COMPACT_SIZE):
+                    self._compact_log()
+            except Exception as e:
+                print(f"Cache log maintenance error: {e}")
 
-        return any(time_elapsed >= record.ttl for record in records)
+    def _compact_log(self) -> None:
+        """Сворачивает журнал в снимок"""
+        # Под блокировкой только меняем файл журнала, снимок пишем без нее,
+        # чтобы add_records не ждал сериализации всего кэша
+        with self._log_lock:
+            if self._log is None:
+                return
+            self._log.close()
+            try:
+                os.replace(self.log_file, self.rotated_log_file)
+            finally:
+                self._log = open(self.log_file, "ab", buffering=LOG_BUFFER_SIZE)
+
+        self.save_cache()
+        os.remove(self.rotated_log_file)
 
     def save_cache(self) -> None:
-        """Сохраняет кэш"""
-        pickle.dump(
-                self.buffer, open(self.path, "wb"), protocol=pickle.HIGHEST_PROTOCOL
-            )
+        """Сохраняет снимок кэша"""
+        offset = time.time() - time.monotonic()
+
+        # Пишем во временный файл, чтобы сбой не оставил кэш недописанным
+        tmp_path = f"{self.cache_file}.tmp"
+        with open(tmp_path, "wb") as file:
+            file.write(CACHE_FILE_MAGIC + bytes([CACHE_FILE_VERSION]) + b"{")
+            separator = b""
+            for shard, lock, lru_lock in zip(self._shards, self._locks, self._lru_locks):
+                # Под блокировками только копируем сегмент, сериализуем уже без них
+                with lock.read_lock(), lru_lock:
+                    items = [(domain, list(entries.items())) for domain, entries in shard.items()]
+
+                # Кодируем частями: один вызов json.dumps на весь кэш надолго
+                # занимает GIL и останавливает цикл обработки запросов
+                for start in range(0, len(items), SNAPSHOT_CHUNK_SIZE):
+                    chunk = {
+                        domain: {
+                            int(q_type): [expiry + offset, [asdict(record) for record in records]]
+                            for q_type, (expiry, records) in entries
+                        }
+                        for domain, entries in items[start:start + SNAPSHOT_CHUNK_SIZE]
+                    }
+                    file.write(separator + json.dumps(chunk, separators=(",", ":"))[1:-1].encode())
+                    separator = b","
+            file.write(b"}")
+        os.replace(tmp_path, self.cache_file)
+
     def shutdown(self) -> None:
         """Корректно завершает работу кэша"""
-        self.cleanup_thread.join(timeout=1)
-        self.save_cache()
\ No newline at end of file
+        # Останавливаем фоновые процессы, чтобы они не меняли кэш во время сохранения
+        self._stop.set()
+        with self._expiry_cond:
+            self._expiry_cond.notify_all()
+        for thread in (self.cleanup_thread, self.log_thread):
+            if thread.is_alive():
+                thread.join()
+
+        if self._log is None:
+            self.save_cache()
+            return
+        self._compact_log()
+        with self._log_lock:
+            self._log.close()
+            self._log = None
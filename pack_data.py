@@ -1,12 +1,24 @@
+import socket
 import struct
-from typing import List, Tuple
+from typing import Dict, List, Tuple
 from parse_data import DNSRecordType, DNSClass, DNSHeader, DNSQuestion, DNSResourceRecord
 
+# Заранее скомпилированные форматы полей DNS-пакета
+_S_HEADER = struct.Struct("!6H")  # Заголовок
+_S_ERROR_HEADER = struct.Struct("!5H")  # Заголовок без Id пакета
+_S_QUESTION = struct.Struct("!HH")  # Тип и класс вопроса
+_S_RR = struct.Struct("!HHI")  # Тип, класс и TTL записи
+_S_LENGTH = struct.Struct("!H")  # Длина данных записи
+_S_LABEL_LENGTH = struct.Struct("!B")  # Длина метки доменного имени
+_S_POINTER = struct.Struct("!H")  # Указатель сжатия имени
+
+# Указатель сжатия может ссылаться только на первые 14 бит смещения
+_MAX_POINTER_OFFSET = 0x3FFF
+
 
 def create_error_response(request_id: bytes) -> bytes:
     """Создает DNS-ответ с ошибкой 'Not Implemented' (код 4)"""
-    return request_id + struct.pack(
-        "!5H",
+    return request_id + _S_ERROR_HEADER.pack(
         (1 << 15) | (4 << 8),  # QR=1 (ответ), RCODE=4 (Not Implemented)
         0,  # Нет вопросов
         0,  # Нет ответов
@@ -22,8 +34,10 @@ def build_response_packet(
 ) -> bytes:
     """Собирает DNS-ответный пакет"""
     # Формируем заголовок ответа
-    header = struct.pack(
-        "!6H",
+    packet = bytearray(_S_HEADER.size)
+    _S_HEADER.pack_into(
+        packet,
+        0,
         request_header.packet_id,
         (1 << 15) | (1 << 8),  # QR=1 (ответ), RD=1 (рекурсия)
         len(questions),
@@ -32,59 +46,99 @@ def build_response_packet(
         0  # Нет additional записей
     )
 
-    # Добавляем вопросы
+    # Смещения уже записанных суффиксов имен для сжатия (RFC 1035, 4.1.4)
+    name_offsets: Dict[str, int] = {}
+
+    # Добавляем вопросы (bytearray растет без копирования всего пакета)
     for question in questions:
-        _, domain_bytes = encode_domain_name(question.domain)
-        header += domain_bytes + struct.pack(
-            "!HH", question.record_type, question.record_class
-        )
+        _write_domain_name(packet, question.domain, name_offsets)
+        packet += _S_QUESTION.pack(question.record_type, question.record_class)
 
     # Добавляем ответы
     for record in answer_records:
-        _, domain_bytes = encode_domain_name(record.domain)
-        header += (
-                domain_bytes +
-                struct.pack("!HHI", record.record_type, record.record_class, record.ttl) +
-                encode_record_data(record.record_type, record.data_length, record.data)
-        )
+        _write_domain_name(packet, record.domain, name_offsets)
+        packet += _S_RR.pack(record.record_type, record.record_class, record.ttl)
+        _write_record_data(packet, record.record_type, record.data, name_offsets)
+
+    return bytes(packet)
+
+
+def _write_domain_name(packet: bytearray, domain: str, name_offsets: Dict[str, int]) -> None:
+    """Дописывает имя в пакет, заменяя уже встречавшийся суффикс указателем"""
+    labels = domain.split(".") if domain else []
+
+    for i in range(len(labels)):
+        suffix = ".".join(labels[i:])
+        offset = name_offsets.get(suffix)
+        if offset is not None:
+            packet += _S_POINTER.pack(0xC000 | offset)
+            return
+
+        if len(packet) <= _MAX_POINTER_OFFSET:
+            name_offsets[suffix] = len(packet)
+        label = labels[i].encode()
+        packet += _S_LABEL_LENGTH.pack(len(label))
+        packet += label
+
+    packet += b"\x00"  # Конец имени
+
+
+def _write_record_data(
+        packet: bytearray,
+        record_type: DNSRecordType,
+        data: str,
+        name_offsets: Dict[str, int],
+) -> None:
+    """Дописывает в пакет длину и данные ресурсной записи"""
+    writer = _RDATA_WRITERS.get(record_type)
+    if writer is None:
+        raise ValueError(f"Unsupported record type: {record_type}")
+    writer(packet, data, name_offsets)
+
+
+def _write_ipv4_data(packet: bytearray, data: str, name_offsets: Dict[str, int]) -> None:
+    """IPv4 адрес (4 байта)"""
+    packet += _S_LENGTH.pack(4)
+    packet += socket.inet_aton(data)
 
-    return header
 
+def _write_name_data(packet: bytearray, data: str, name_offsets: Dict[str, int]) -> None:
+    """Доменное имя (NS или PTR запись), сжимается вместе с остальными именами"""
+    # Длину дописываем после записи имени: со сжатием она заранее неизвестна
+    length_pos = len(packet)
+    packet += bytes(_S_LENGTH.size)
+    _write_domain_name(packet, data, name_offsets)
+    _S_LENGTH.pack_into(packet, length_pos, len(packet) - length_pos - _S_LENGTH.size)
 
-def encode_record_data(record_type: DNSRecordType, length: int, data: str) -> bytes:
-    """Кодирует данные ресурсной записи в DNS-формат"""
-    if record_type == DNSRecordType.A:
-        # IPv4 адрес (4 байта)
-        octets = list(map(int, data.split(".")))
-        return struct.pack(f"!H4B", length, *octets)
 
-    elif record_type in (DNSRecordType.NS, DNSRecordType.PTR):
-        # Доменное имя (NS или PTR запись)
-        encoded_length, encoded_data = encode_domain_name(data)
-        return struct.pack("!H", encoded_length) + encoded_data
+def _write_ipv6_data(packet: bytearray, data: str, name_offsets: Dict[str, int]) -> None:
+    """IPv6 адрес (16 байт)"""
+    packet += _S_LENGTH.pack(16)
+    packet += socket.inet_pton(socket.AF_INET6, data)
 
-    elif record_type == DNSRecordType.AAAA:
-        # IPv6 адрес (16 байт)
-        hextets = [int(octet, 16) for octet in data.split(":")]
-        return struct.pack(f"!H8H", length, *hextets)
 
-    raise ValueError(f"Unsupported record type: {record_type}")
+# Запись данных ресурсной записи по числовому типу
+_RDATA_WRITERS = {
+    DNSRecordType.A.value: _write_ipv4_data,
+    DNSRecordType.NS.value: _write_name_data,
+    DNSRecordType.PTR.value: _write_name_data,
+    DNSRecordType.AAAA.value: _write_ipv6_data,
+}
 
 
 def encode_domain_name(domain: str) -> Tuple[int, bytes]:
     """Кодирует доменное имя в DNS-формат"""
-    encoded = bytes()
-    total_length = 0
+    parts = []
 
     for label in domain.split("."):
-        label_len = len(label)
-        encoded += struct.pack(f"!B{label_len}s", label_len, label.encode())
-        total_length += label_len + 1  # +1 для байта длины
+        encoded_label = label.encode()
+        parts.append(_S_LABEL_LENGTH.pack(len(encoded_label)))
+        parts.append(encoded_label)
 
-    encoded += b"\x00"  # Конец имени
-    total_length += 1
+    parts.append(b"\x00")  # Конец имени
+    encoded = b"".join(parts)
 
-    return total_length, encoded
+    return len(encoded), encoded
 
 
 def build_query_packet(
@@ -95,8 +149,7 @@ def build_query_packet(
 ) -> bytes:
     """Создает DNS-запросный пакет"""
     # Заголовок запроса
-    header = struct.pack(
-        "!6H",
+    header = _S_HEADER.pack(
         query_id,
         0x0100,  # Стандартные флаги запроса (RD=1)
         1,  # Один вопрос
@@ -105,6 +158,6 @@ def build_query_packet(
 
     # Добавляем вопрос
     _, encoded_domain = encode_domain_name(domain)
-    question = encoded_domain + struct.pack("!HH", record_type, record_class)
+    question = encoded_domain + _S_QUESTION.pack(record_type, record_class)
 
     return header + question
@@ -1,8 +1,17 @@
+import socket
 import struct
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from enum import Enum
 from typing import List
 
+# Заранее скомпилированные форматы полей DNS-пакета
+_S_HEADER = struct.Struct("!6H")  # Заголовок
+_S_QUESTION = struct.Struct("!HH")  # Тип и класс вопроса
+_S_RR = struct.Struct("!HHIH")  # Тип, класс, TTL и длина данных записи
+
+# Строковые представления байтов для сборки IPv4 адреса без str() на каждый октет
+_OCTETS = tuple(str(i) for i in range(256))
+
 
 class DNSRecordType(int, Enum):
     """Типы DNS-записей"""
@@ -17,7 +26,7 @@ class DNSClass(int, Enum):
     IN = 1  # Интернет
 
 
-@dataclass
+@dataclass(slots=True)
 class DNSHeader:
     """Заголовок DNS-пакета"""
     packet_id: int  # Id пакета
@@ -28,7 +37,7 @@ class DNSHeader:
     additional_count: int  # Количество дополнительных записей
 
 
-@dataclass
+@dataclass(slots=True)
 class DNSQuestion:
     """DNS-запрос"""
     domain: str  # Доменное имя
@@ -36,7 +45,7 @@ class DNSQuestion:
     record_class: DNSClass  # Класс записи
 
 
-@dataclass
+@dataclass(slots=True)
 class DNSResourceRecord:
     """DNS-запись (ресурсная запись)"""
     domain: str  # Доменное имя
@@ -47,7 +56,7 @@ class DNSResourceRecord:
     data: str  # Данные записи
 
 
-@dataclass
+@dataclass(slots=True)
 class DNSPacket:
     """Полный DNS-пакет"""
     raw_data: bytes
@@ -57,9 +66,11 @@ class DNSPacket:
     answers: List[DNSResourceRecord] = None
     authority_records: List[DNSResourceRecord] = None
     additional_records: List[DNSResourceRecord] = None
+    _view: memoryview = field(default=None, init=False, repr=False, compare=False)
 
     def __post_init__(self):
         """Инициализация пакета - парсинг всех частей"""
+        self._view = memoryview(self.raw_data)
         self.questions = []
         self.answers = []
         self.authority_records = []
@@ -70,23 +81,19 @@ class DNSPacket:
 
     def _parse_header(self):
         """Парсинг заголовка DNS-пакета"""
-        header_size = 12  # Размер заголовка в байтах
-        self.header = DNSHeader(*struct.unpack("!6H", self.raw_data[:header_size]))
-        self._position += header_size
+        self.header = DNSHeader(*_S_HEADER.unpack_from(self.raw_data, 0))
+        self._position += _S_HEADER.size
 
     def _parse_questions(self):
         """Парсинг секции вопросов"""
-        question_size = 4  # Размер вопроса в байтах
         for _ in range(self.header.questions_count):
             self.questions.append(
                 DNSQuestion(
                     self._read_domain_name(),
-                    *struct.unpack(
-                        "!HH", self.raw_data[self._position: self._position + question_size]
-                    ),
+                    *_S_QUESTION.unpack_from(self.raw_data, self._position),
                 )
             )
-            self._position += question_size
+            self._position += _S_QUESTION.size
 
     def _parse_all_records(self):
         """Парсинг всех секций с записями"""
@@ -100,13 +107,11 @@ class DNSPacket:
 
     def _parse_record_section(self, records, count):
         """Парсинг одной секции записей (ответы, authority или additional)"""
-        record_header_size = 10  # Размер заголовка записи
+        unpack_record_header = _S_RR.unpack_from
         for _ in range(count):
             domain = self._read_domain_name()
-            r_type, r_class, ttl, data_len = struct.unpack(
-                "!HHIH", self.raw_data[self._position: self._position + record_header_size]
-            )
-            self._position += record_header_size
+            r_type, r_class, ttl, data_len = unpack_record_header(self.raw_data, self._position)
+            self._position += _S_RR.size
             record_data = self._parse_record_data(r_type, data_len)
             records.append(
                 DNSResourceRecord(domain, r_type, r_class, ttl, data_len, record_data)
@@ -114,24 +119,33 @@ class DNSPacket:
 
     def _read_domain_name(self):
         """Читает доменное имя из DNS-пакета с учетом сжатия"""
-        name_parts = []
+        # Локальные ссылки вместо обращений к атрибутам в цикле по меткам
+        raw_data = self.raw_data
+        view = self._view
+        packet_length = len(raw_data)
+        name = bytearray()
         current_pos = self._position
+        run_start = current_pos  # начало текущей цепочки меток (цель последнего перехода)
         compression_offset = None  # позиция после указателя укорочения
 
         while True:
-            byte = self.raw_data[current_pos]
+            byte = raw_data[current_pos]
 
             # Проверка на сжатие (первые 2 бита = 11)
-            if (byte & 0xC0) == 0xC0:
+            if byte >= 0xC0:
+                if current_pos + 1 >= packet_length:
+                    raise ValueError("Invalid compression offset")
                 if compression_offset is None:
                     compression_offset = current_pos + 2
 
-                # смещение (14 младших битов)
-                offset = ((byte & 0x3F) << 8) | self.raw_data[current_pos + 1]
-                if offset >= len(self.raw_data):
+                # смещение (14 младших битов); указатель должен вести раньше начала
+                # текущей цепочки меток - цели переходов строго убывают, и петля
+                # из указателей невозможна
+                offset = ((byte & 0x3F) << 8) | raw_data[current_pos + 1]
+                if offset >= run_start:
                     raise ValueError("Invalid compression offset")
 
-                current_pos = offset
+                current_pos = run_start = offset
                 continue
 
             # Мы уже обработали сжатие (192-255), поэтому сюда попадём только при 64-191
@@ -139,51 +153,57 @@ class DNSPacket:
                 raise ValueError(f"Invalid label length: {byte}")
 
             if byte == 0:
-                if compression_offset is None:
-                    self._position = current_pos + 1
-                else:
-                    self._position = compression_offset
                 break
 
-            label_length = byte
             current_pos += 1
-            label_end = current_pos + label_length
+            label_end = current_pos + byte
 
-            if label_end > len(self.raw_data):
+            if label_end > packet_length:
                 raise ValueError("Label exceeds packet bounds")
 
-            name_parts.append(self.raw_data[current_pos:label_end])
+            name += view[current_pos:label_end]
+            name.append(0x2E)  # "."
             current_pos = label_end
 
+        self._position = current_pos + 1 if compression_offset is None else compression_offset
+
         try:
-            return ".".join(part.decode('ascii') for part in name_parts)
+            return name[:-1].decode('ascii')
         except UnicodeDecodeError:
             raise ValueError("Invalid ASCII in domain name")
 
-
     def _parse_record_data(self, record_type, data_length):
         """Парсинг данных записи в зависимости от типа"""
-        if record_type == DNSRecordType.A.value:
-            # IPv4 адрес (4 байта)
-            octets = struct.unpack(
-                f"!{data_length}B",
-                self.raw_data[self._position: self._position + data_length],
-            )
-            self._position += data_length
-            return ".".join(str(octet) for octet in octets)
-
-        elif record_type == DNSRecordType.NS.value or record_type == DNSRecordType.PTR.value:
-            # Доменное имя (NS или PTR запись)
-            return self._read_domain_name()
-
-        elif record_type == DNSRecordType.AAAA.value:
-            # IPv6 адрес (16 байт)
-            hextets = struct.unpack(
-                f"!{data_length // 2}H",
-                self.raw_data[self._position: self._position + data_length],
-            )
-            self._position += data_length
-            return ":".join(f"{hextet:04x}" for hextet in hextets)
+        parser = _RDATA_PARSERS.get(record_type)
+        if parser is None:
+            raise ValueError(f"Unsupported record type: {record_type}")
+        return parser(self, data_length)
+
+    def _parse_ipv4_data(self, data_length):
+        """IPv4 адрес (4 байта)"""
+        if data_length != 4:
+            raise ValueError(f"Invalid IPv4 address length: {data_length}")
+        b0, b1, b2, b3 = self._view[self._position: self._position + 4]
+        self._position += 4
+        return f"{_OCTETS[b0]}.{_OCTETS[b1]}.{_OCTETS[b2]}.{_OCTETS[b3]}"
+
+    def _parse_name_data(self, data_length):
+        """Доменное имя (NS или PTR запись)"""
+        return self._read_domain_name()
+
+    def _parse_ipv6_data(self, data_length):
+        """IPv6 адрес (16 байт)"""
+        address = socket.inet_ntop(
+            socket.AF_INET6, self._view[self._position: self._position + data_length]
+        )
+        self._position += data_length
+        return address
+
 
-        else:
-            raise ValueError(f"Unsupported record type: {record_type}")
\ No newline at end of file
+# Разбор данных записи по числовому типу (один поиск в словаре на запись)
+_RDATA_PARSERS = {
+    DNSRecordType.A.value: DNSPacket._parse_ipv4_data,
+    DNSRecordType.NS.value: DNSPacket._parse_name_data,
+    DNSRecordType.PTR.value: DNSPacket._parse_name_data,
+    DNSRecordType.AAAA.value: DNSPacket._parse_ipv6_data,
+}
@@ -1,6 +1,8 @@
-import socket
-from typing import List, Optional
-from dataclasses import dataclass
+import asyncio
+import secrets
+import struct
+from typing import Dict, List, Optional, Tuple
+from dataclasses import dataclass, field
 
 import pack_data
 import json_dependencies
@@ -9,6 +11,62 @@ from parse_data import DNSPacket, DNSClass, DNSRecordType
 # Загрузка конфигурации
 server_config = json_dependencies.load_server_configs()
 
+# Время ожидания ответа от DNS-сервера (секунды)
+QUERY_TIMEOUT = 5
+
+
+# Вопрос запроса для сверки с ответом: (имя в нижнем регистре, тип, класс)
+QuestionKey = Tuple[str, int, int]
+
+# Ожидающий запрос: адрес опрошенного сервера, отправленные вопросы и future для ответа
+PendingQuery = Tuple[tuple, List[QuestionKey], asyncio.Future]
+
+
+def _question_keys(packet: DNSPacket) -> List[QuestionKey]:
+    """Вопросы пакета в виде, пригодном для сравнения"""
+    return [
+        (question.domain.lower(), question.record_type, question.record_class)
+        for question in packet.questions
+    ]
+
+
+class _ResolverProtocol(asyncio.DatagramProtocol):
+    """Принимает ответы вышестоящих серверов и передает их ожидающим запросам"""
+
+    def __init__(self, pending: Dict[int, PendingQuery], request_size: int):
+        self._pending = pending
+        self._request_size = request_size
+
+    def datagram_received(self, data: bytes, addr: tuple) -> None:
+        if not 2 <= len(data) <= self._request_size:
+            return
+        txn_id, = struct.unpack("!H", data[:2])
+        query = self._pending.get(txn_id)
+        if query is None:
+            return
+        server_address, questions, future = query
+        # Сокет общий и не подключен, поэтому ответ с чужого адреса отбрасываем
+        if addr[:2] != server_address or future.done():
+            return
+        # Неразбираемый ответ (например, с неподдерживаемым типом записи)
+        # завершает запрос сразу, а не по таймауту
+        try:
+            response = DNSPacket(data)
+        except (ValueError, IndexError, struct.error) as e:
+            future.set_exception(ValueError(f"Malformed response from {addr[0]}: {e}"))
+            return
+        # Адрес отправителя легко подделать, поэтому ответ принимаем, только если
+        # он относится к тому же вопросу, что и отправленный запрос
+        if _question_keys(response) != questions:
+            return
+        future.set_result(response)
+
+    def connection_lost(self, exc: Optional[Exception]) -> None:
+        # Транспорт закрыт - ответов уже не будет, не ждем таймаута
+        for _, _, future in self._pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError("Resolver transport closed"))
+
 
 @dataclass
 class DNSResolver:
@@ -17,19 +75,40 @@ class DNSResolver:
     request_size: int = server_config["request_size"]
     root_server_ip: str = server_config["root_server_ip"]
     root_server_port: int = server_config["root_server_port"]
+    _transport: Optional[asyncio.DatagramTransport] = field(default=None, init=False, repr=False)
+    _pending: Dict[int, PendingQuery] = field(default_factory=dict, init=False, repr=False)
+
+    async def start(self) -> None:
+        """Открывает общий UDP-транспорт для исходящих запросов"""
+        loop = asyncio.get_running_loop()
+        self._transport, _ = await loop.create_datagram_endpoint(
+            lambda: _ResolverProtocol(self._pending, self.request_size),
+            local_addr=("0.0.0.0", 0),
+        )
 
-    def recursive_resolve(
+    def close(self) -> None:
+        """Закрывает транспорт и отменяет незавершенные запросы"""
+        if self._transport:
+            self._transport.close()
+            self._transport = None
+        for _, _, future in self._pending.values():
+            future.cancel()
+        self._pending.clear()
+
+    async def recursive_resolve(
             self,
             dns_query: bytes,
             target_server_ip: str = None,
             target_server_port: int = 53
     ) -> Optional[DNSPacket]:
         """Выполняет рекурсивное разрешение DNS-запроса"""
-        target_server_ip = target_server_ip or self.root_server_ip
-        target_server_port = target_server_port or self.root_server_port
+        # Порт из настроек относится только к корневому серверу,
+        # серверы из ответов-направлений опрашиваются на стандартном порту
+        if target_server_ip is None:
+            target_server_ip = self.root_server_ip
+            target_server_port = self.root_server_port
 
-        response = self._query_dns_server(dns_query, target_server_ip, target_server_port)
-        response_packet = DNSPacket(response)
+        response_packet = await self._query_dns_server(dns_query, target_server_ip, target_server_port)
 
         # Если есть прямые ответы - возвращаем их
         if response_packet.header.answers_count > 0:
@@ -37,33 +116,46 @@ class DNSResolver:
 
         # Обработка authoritative записей
         if response_packet.header.authority_count > 0:
-            return self._handle_authoritative_records(dns_query, response_packet)
+            return await self._handle_authoritative_records(dns_query, response_packet)
 
         return None
 
-    def _handle_authoritative_records(
+    async def _handle_authoritative_records(
             self,
             dns_query: bytes,
             response_packet: DNSPacket
     ) -> Optional[DNSPacket]:
         """Обрабатывает authoritative записи для продолжения рекурсивного разрешения"""
-        for auth_record in response_packet.authority_records:
-            # Проверяем дополнительные записи на наличие IP
-            for additional_record in response_packet.additional_records:
-                if additional_record.record_type == DNSRecordType.A:
-                    return self.recursive_resolve(dns_query, additional_record.data)
-
-            # Если в дополнительных записях нет IP, разрешаем имя authoritative сервера
-            resolved_ips = self._resolve_name_to_ips(
+        # IP серверов имен из дополнительных записей (glue), по имени сервера
+        glue = {
+            record.domain.lower(): record.data
+            for record in response_packet.additional_records
+            if record.record_type == DNSRecordType.A
+        }
+        ns_names = [
+            record.data
+            for record in response_packet.authority_records
+            if record.record_type == DNSRecordType.NS
+        ]
+
+        # Сначала сервер, для которого IP уже известен
+        for ns_name in ns_names:
+            ns_ip = glue.get(ns_name.lower())
+            if ns_ip:
+                return await self.recursive_resolve(dns_query, ns_ip)
+
+        # Если в дополнительных записях нет IP, разрешаем имя authoritative сервера
+        for ns_name in ns_names:
+            resolved_ips = await self._resolve_name_to_ips(
                 response_packet.header.packet_id,
-                auth_record.data
+                ns_name
             )
             if resolved_ips:
-                return self.recursive_resolve(dns_query, resolved_ips[0])
+                return await self.recursive_resolve(dns_query, resolved_ips[0])
 
         return None
 
-    def _resolve_name_to_ips(
+    async def _resolve_name_to_ips(
             self,
             query_id: int,
             domain_name: str
@@ -76,20 +168,37 @@ class DNSResolver:
             DNSClass.IN,
         )
 
-        response = self.recursive_resolve(query)
+        response = await self.recursive_resolve(query)
         if response:
             return [answer.data for answer in response.answers]
         return None
 
-    def _query_dns_server(
+    def _new_txn_id(self) -> int:
+        """Выбирает случайный свободный ID запроса"""
+        # Все запросы уходят с одного порта, поэтому ID должен быть непредсказуем,
+        # иначе ответ легко подделать
+        while True:
+            txn_id = secrets.randbits(16)
+            if txn_id not in self._pending:
+                return txn_id
+
+    async def _query_dns_server(
             self,
             request: bytes,
             server_ip: str,
             server_port: int = 53
-    ) -> bytes:
-        """Отправляет запрос DNS-серверу и возвращает ответ"""
-        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
-            sock.settimeout(5)
-            sock.connect((server_ip, server_port))
-            sock.send(request)
-            return sock.recv(self.request_size)
\ No newline at end of file
+    ) -> DNSPacket:
+        """Отправляет запрос DNS-серверу и возвращает разобранный ответ"""
+        if self._transport is None:
+            raise ConnectionError("Resolver transport is not started")
+
+        # Подменяем ID запроса, чтобы сопоставить ответ с ожидающим запросом
+        txn_id = self._new_txn_id()
+        server_address = (server_ip, server_port)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[txn_id] = (server_address, _question_keys(DNSPacket(request)), future)
+        try:
+            self._transport.sendto(struct.pack("!H", txn_id) + request[2:], server_address)
+            return await asyncio.wait_for(future, QUERY_TIMEOUT)
+        finally:
+            self._pending.pop(txn_id, None)
@@ -1,21 +1,45 @@
+import asyncio
 import signal
 import socket
-from typing import List
+from typing import List, Set
 
 import pack_data
 import json_dependencies
 import resolver_dns
-from cache_dns import DNSCache
+from cache_dns import DEFAULT_MAX_ENTRIES, DNSCache
 from parse_data import DNSPacket, DNSQuestion, DNSResourceRecord, DNSRecordType, DNSClass
 
+# Предел числа одновременно обрабатываемых запросов, если он не задан в настройках
+DEFAULT_MAX_PENDING_REQUESTS = 64
+
+
+class _ServerProtocol(asyncio.DatagramProtocol):
+    """Принимает запросы клиентов и передает их серверу"""
+
+    def __init__(self, server: "Server"):
+        self._server = server
+
+    def datagram_received(self, data: bytes, addr: tuple) -> None:
+        self._server.dispatch_request(data, addr)
+
+    def error_received(self, exc: Exception) -> None:
+        print(f"Socket error: {exc}")
+
 
 class Server:
     def __init__(self):
         self.settings = json_dependencies.load_server_configs()
         self._server_socket = None
+        self._transport = None
         self._cacher = None
         self._resolver = None
-        self._handle_flag = True
+        self._loop = None
+        self._stop_event = None
+        self._accepting = False
+        self._tasks: Set[asyncio.Task] = set()
+        self._max_pending_requests = self.settings.get(
+            "max_pending_requests", DEFAULT_MAX_PENDING_REQUESTS
+        )
         self._initialize()
 
     def _initialize(self):
@@ -29,12 +53,14 @@ class Server:
         """Инициализация серверного сокета"""
         self._server_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self._server_socket.bind((self.settings["server_ip"], self.settings["server_port"]))
+        self._server_socket.setblocking(False)
 
     def _init_cacher(self):
         """Инициализация кэша DNS записей"""
         self._cacher = DNSCache(
             self.settings["cache_filepath"],
-            self.settings["clean_period"]
+            self.settings["clean_period"],
+            self.settings.get("max_cache_entries", DEFAULT_MAX_ENTRIES)
         )
         self._cacher.initialize_cache()
         self._cacher.start_cleanup_process()
@@ -48,24 +74,56 @@ class Server:
         )
 
     def run(self):
-        """Основной цикл обработки запросов"""
+        """Запуск цикла обработки запросов"""
         print(f"Server started on {self.settings['server_ip']}:{self.settings['server_port']}")
-        while self._handle_flag:
-            try:
-                request, address = self._server_socket.recvfrom(self.settings["request_size"])
-                self._handle_client(request, address)
-            except socket.error as e:
-                if self._handle_flag:
-                    print(f"Socket error: {e}")
-
-    def _handle_client(self, request: bytes, address: tuple):
+        asyncio.run(self._serve())
+
+    async def _serve(self):
+        """Основной цикл обработки запросов"""
+        self._loop = asyncio.get_running_loop()
+        self._stop_event = asyncio.Event()
+        self._transport, _ = await self._loop.create_datagram_endpoint(
+            lambda: _ServerProtocol(self),
+            sock=self._server_socket
+        )
+        await self._resolver.start()
+        self._accepting = True
+        try:
+            await self._stop_event.wait()
+        finally:
+            await self._drain_requests()
+            self._transport.close()
+            self._resolver.close()
+            self._cacher.shutdown()
+
+    async def _drain_requests(self):
+        """Перестает принимать запросы и дожидается уже принятых"""
+        self._accepting = False
+        if self._tasks:
+            _, pending = await asyncio.wait(self._tasks, timeout=resolver_dns.QUERY_TIMEOUT)
+            for task in pending:
+                task.cancel()
+
+    def dispatch_request(self, request: bytes, address: tuple):
+        """Запускает обработку запроса, не блокируя прием следующих"""
+        if not self._accepting:
+            return
+        # Сверх лимита запрос отбрасываем, а не ставим в очередь: иначе при наплыве
+        # число ожидающих задач растет без ограничений
+        if len(self._tasks) >= self._max_pending_requests:
+            return
+        task = self._loop.create_task(self._handle_client(request, address))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _handle_client(self, request: bytes, address: tuple):
         """Обработка запроса от клиента"""
         try:
             request_package = DNSPacket(request)
             total_a_records = []
 
             for question in request_package.questions:
-                records = self._process_question(
+                records = await self._process_question(
                     question=question,
                     packet_id=request_package.header.packet_id
                 )
@@ -76,15 +134,14 @@ class Server:
                 request_package.questions,
                 total_a_records
             )
-            self._server_socket.sendto(response, address)
+            self._transport.sendto(response, address)
 
         except Exception as e:
             print(f"Error handling request: {e}")
-            print("tut")
             error_response = pack_data.create_error_response(request[:2])
-            self._server_socket.sendto(error_response, address)
+            self._transport.sendto(error_response, address)
 
-    def _process_question(self, question: DNSQuestion, packet_id: int) -> List[DNSResourceRecord]:
+    async def _process_question(self, question: DNSQuestion, packet_id: int) -> List[DNSResourceRecord]:
         """Обработка одного DNS вопроса"""
         # if question.domain == "whoami.dns":
         #     print(f"[DEBUG] Это мой сервер! Запрос от {question.domain}")
@@ -101,7 +158,7 @@ class Server:
         cached_records = self._cacher.get_records(question.domain, question.record_type)
         if cached_records is not None:
             print(f"[Cache] Found records for {question.domain}")
-            return cached_records[1]  # Возвращаем список записей
+            return cached_records
 
         # Рекурсивное разрешение, если нет в кэше
         print(f"[Resolver] Resolving {question.domain}")
@@ -113,7 +170,7 @@ class Server:
         )
 
         try:
-            answer = self._resolver.recursive_resolve(q_request)
+            answer = await self._resolver.recursive_resolve(q_request)
             if answer and answer.answers:
                 self._cacher.add_records(question.domain, question.record_type, answer.answers)
                 return answer.answers
@@ -125,9 +182,5 @@ class Server:
     def _close(self, signum=None, frame=None):
         """Корректное завершение работы сервера"""
         print("\nShutting down server...")
-        self._handle_flag = False
-        if self._server_socket:
-            self._server_socket.close()
-        if self._cacher:
-            self._cacher.save()
-            self._cacher.close()
\ No newline at end of file
+        if self._loop and self._stop_event:
+            self._loop.call_soon_threadsafe(self._stop_event.set)
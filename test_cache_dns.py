@@ -0,0 +1,150 @@
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+from cache_dns import CACHE_SHARDS, DNSCache
+from parse_data import DNSRecordType, DNSResourceRecord
+
+
+def _records(domain: str, ttl: int = 300) -> list:
+    return [DNSResourceRecord(domain, DNSRecordType.A, 1, ttl, 4, "1.2.3.4")]
+
+
+class DNSCacheTest(unittest.TestCase):
+    """Кэш DNS-записей: вытеснение, сохранение и восстановление"""
+
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.cache_file = os.path.join(self._dir.name, "cache.txt")
+        self._caches = []
+
+    def tearDown(self):
+        for cache in self._caches:
+            if cache._log is not None:
+                cache._log.close()
+        self._dir.cleanup()
+
+    def _open_cache(self, max_entries: int = 1000) -> DNSCache:
+        cache = DNSCache(self.cache_file, 3600, max_entries)
+        cache.initialize_cache()
+        self._caches.append(cache)
+        return cache
+
+    @staticmethod
+    def _size(cache: DNSCache) -> int:
+        return sum(len(shard) for shard in cache._shards)
+
+    def test_size_limited_by_max_entries(self):
+        cache = self._open_cache(max_entries=10)
+        for i in range(200):
+            cache.add_records(f"host{i}.com", DNSRecordType.A, _records(f"host{i}.com"))
+        self.assertLessEqual(self._size(cache), 10)
+
+    def test_hit_refreshes_lru_position(self):
+        # По две записи на сегмент; нужны три домена из одного сегмента
+        cache = self._open_cache(max_entries=2 * CACHE_SHARDS)
+        index = DNSCache._shard("host0.com")
+        first, second, third = [
+            domain
+            for domain in (f"host{i}.com" for i in range(10_000))
+            if DNSCache._shard(domain) == index
+        ][:3]
+
+        cache.add_records(first, DNSRecordType.A, _records(first))
+        cache.add_records(second, DNSRecordType.A, _records(second))
+        self.assertIsNotNone(cache.get_records(first, DNSRecordType.A))
+        cache.add_records(third, DNSRecordType.A, _records(third))
+
+        self.assertIsNotNone(cache.get_records(first, DNSRecordType.A))
+        self.assertIsNone(cache.get_records(second, DNSRecordType.A))
+        self.assertIsNotNone(cache.get_records(third, DNSRecordType.A))
+
+    def test_save_and_reload(self):
+        cache = self._open_cache()
+        cache.add_records("a.com", DNSRecordType.A, _records("a.com"))
+        # Тип вопроса вне DNSRecordType (ANY) тоже должен пережить перезапуск
+        cache.add_records("any.com", 255, _records("any.com"))
+        cache.add_records("old.com", DNSRecordType.A, _records("old.com", ttl=0))
+        cache.shutdown()
+
+        reloaded = self._open_cache()
+        self.assertEqual(reloaded.get_records("a.com", DNSRecordType.A), _records("a.com"))
+        self.assertEqual(reloaded.get_records("any.com", 255), _records("any.com"))
+        self.assertIsNone(reloaded.get_records("old.com", DNSRecordType.A))
+
+    def test_rotated_log_recovered(self):
+        cache = self._open_cache()
+        cache.add_records("a.com", DNSRecordType.A, _records("a.com"))
+        # Падение во время сворачивания: журнал отложен, снимок еще не записан
+        with cache._log_lock:
+            cache._log.close()
+            cache._log = None
+        os.replace(cache.log_file, cache.rotated_log_file)
+
+        reloaded = self._open_cache()
+        self.assertEqual(reloaded.get_records("a.com", DNSRecordType.A), _records("a.com"))
+        self.assertFalse(os.path.exists(reloaded.rotated_log_file))
+
+    def test_torn_log_line(self):
+        line = json.dumps(
+            ["a.com", 1, time.time() + 300, [
+                {"domain": "a.com", "record_type": 1, "record_class": 1,
+                 "ttl": 300, "data_length": 4, "data": "1.2.3.4"},
+            ]]
+        ).encode()
+        with open(f"{self.cache_file}.log", "wb") as file:
+            file.write(line + b"\n" + line[:20])
+
+        cache = self._open_cache()
+        cache.add_records("b.com", DNSRecordType.A, _records("b.com"))
+        cache.add_records("c.com", DNSRecordType.A, _records("c.com"))
+        with cache._log_lock:
+            cache._log.flush()
+
+        reloaded = self._open_cache()
+        for domain in ("a.com", "b.com", "c.com"):
+            self.assertIsNotNone(reloaded.get_records(domain, DNSRecordType.A), domain)
+
+    def test_save_during_concurrent_reads(self):
+        cache = self._open_cache(max_entries=10_000)
+        domains = [f"host{i}.com" for i in range(5000)]
+        for domain in domains:
+            cache.add_records(domain, DNSRecordType.A, _records(domain))
+
+        errors = []
+        stop = threading.Event()
+
+        def read():
+            try:
+                while not stop.is_set():
+                    for domain in domains:
+                        cache.get_records(domain, DNSRecordType.A)
+            except Exception as e:
+                errors.append(e)
+
+        # Частое переключение потоков, чтобы чтение попадало внутрь обхода сегментов
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        readers = [threading.Thread(target=read) for _ in range(4)]
+        for reader in readers:
+            reader.start()
+        try:
+            for _ in range(20):
+                cache.save_cache()
+        finally:
+            stop.set()
+            for reader in readers:
+                reader.join()
+            sys.setswitchinterval(switch_interval)
+
+        self.assertEqual(errors, [])
+        reloaded = self._open_cache(max_entries=10_000)
+        self.assertEqual(self._size(reloaded), len(domains))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,33 @@
+import struct
+import unittest
+
+from parse_data import DNSPacket
+
+
+class ReadDomainNameTest(unittest.TestCase):
+    """Разбор доменных имен со сжатием"""
+
+    @staticmethod
+    def _query(name: bytes) -> bytes:
+        return struct.pack("!6H", 1, 0x0100, 1, 0, 0, 0) + name + struct.pack("!HH", 1, 1)
+
+    def test_backward_pointer(self):
+        packet = self._query(b"\x03www\x07example\x03com\x00")
+        answer = (
+            b"\xc0\x10" + struct.pack("!HHIH", 1, 1, 60, 4) + bytes([1, 2, 3, 4])
+        )
+        raw = struct.pack("!6H", 1, 0x8180, 1, 1, 0, 0) + packet[12:] + answer
+        self.assertEqual(DNSPacket(raw).answers[0].domain, "example.com")
+
+    def test_self_pointer_rejected(self):
+        with self.assertRaises(ValueError):
+            DNSPacket(self._query(b"\xc0\x0c"))
+
+    def test_pointer_loop_through_label_rejected(self):
+        # Метка "a" по смещению 12, затем указатель обратно на нее же
+        with self.assertRaises(ValueError):
+            DNSPacket(self._query(b"\x01a\xc0\x0c"))
+
+
+if __name__ == "__main__":
+    unittest.main()